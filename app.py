@@ -1,57 +1,112 @@
+import atexit
 import json
 import os
+import queue
+import threading
 import time
-from flask import Flask, render_template, request, redirect, url_for, flash, g
+from collections import Counter
+from flask import Flask, render_template, request, redirect, url_for, flash, g, session, get_flashed_messages, Response, stream_template, stream_with_context
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from opentelemetry import trace
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Fall back to the stdlib json module
+
+def _loads(data):
+    """Parse JSON from bytes/str, using orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _dumps(obj, indent=False):
+    """Serialize to JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        # OPT_NON_STR_KEYS matches stdlib json, which coerces keys like
+        # None to strings instead of raising (telemetry keys route
+        # counters by request.endpoint, which is None for unmatched URLs)
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
 # Flask App Initialization
 app = Flask(__name__)
 app.secret_key = 'secret'  # Secret key for session management
-COURSE_FILE = 'course_catalog.json'  # File to store course data
+COURSE_FILE = 'course_catalog.jsonl'  # File to store course data, one JSON object per line
+LEGACY_COURSE_FILE = 'course_catalog.json'  # Old JSON-array format, migrated on first load
 TELEMETRY_FILE = 'telemetry_data.json'  # File to store telemetry data
 
 # Telemetry Data Storage
+# Counters default missing keys to zero, so increments need no setdefault;
+# the lock keeps updates and snapshots consistent under the threaded server
 telemetry_data = {
-    "route_requests": {},
-    "route_processing_time": {},
-    "errors": {}
+    "route_requests": Counter(),
+    "route_processing_time": Counter(),
+    "errors": Counter()
 }
+TELEMETRY_FLUSH_EVERY = 100  # Flush telemetry to disk once per N updates
+_telemetry_dirty = 0
+_telemetry_lock = threading.Lock()
+# Separate lock for the file write so counter updates never block on disk
+_telemetry_write_lock = threading.Lock()
 
 # OpenTelemetry Configuration
-tracer = trace.get_tracer(__name__)
-trace.set_tracer_provider(TracerProvider())
+# Sample a fraction of traces instead of exporting every request;
+# ParentBased keeps child spans consistent with the sampled root
+trace.set_tracer_provider(TracerProvider(
+    sampler=ParentBased(TraceIdRatioBased(float(os.getenv("OTEL_SAMPLE_RATIO", "0.1"))))
+))
 jaeger_exporter = JaegerExporter(
     agent_host_name="localhost",
     agent_port=6831,
 )
-span_processor = BatchSpanProcessor(jaeger_exporter)
+# Batch export parameters tuned for burst traffic; overridable per environment
+span_processor = BatchSpanProcessor(
+    jaeger_exporter,
+    max_queue_size=int(os.getenv("SPAN_MAX_QUEUE_SIZE", "4096")),
+    schedule_delay_millis=int(os.getenv("SPAN_SCHEDULE_DELAY_MILLIS", "1000")),
+    max_export_batch_size=int(os.getenv("SPAN_MAX_EXPORT_BATCH_SIZE", "256")),
+    export_timeout_millis=int(os.getenv("SPAN_EXPORT_TIMEOUT_MILLIS", "10000")),
+)
 trace.get_tracer_provider().add_span_processor(span_processor)
+# Resolve the tracer once, after the real provider is set, so routes
+# don't go through the proxy tracer on every span
+tracer = trace.get_tracer(__name__)
 FlaskInstrumentor().instrument_app(app)
 
 # Logging Configuration
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 
-# Custom JSON Formatter for logging
+# Custom JSON Formatter for logging. Level filtering belongs to the logger
+# and handlers (setLevel), not here: returning '' from format would still
+# emit the record terminator as a blank line.
 class JsonFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self._format_time = self.formatTime  # Cache the bound method per formatter
+
     def format(self, record):
         log_record = {
-            'timestamp': self.formatTime(record),
+            'timestamp': self._format_time(record),
             'level': record.levelname,
             'message': record.getMessage(),
             'logger_name': record.name,
-            'path': record.pathname,
+            'module': record.module,  # Shorter to serialize than the full pathname
             'line': record.lineno,
         }
-        return json.dumps(log_record)
+        return _dumps(log_record).decode()
 
-# File logging with rotation
+# File logging with rotation. This handler is driven by the QueueListener
+# below, so the per-emit size check and any rollover run on the listener
+# thread and never add latency to a request thread.
 file_handler = RotatingFileHandler('application.log', maxBytes=5 * 1024 * 1024, backupCount=2)
 file_handler.setFormatter(JsonFormatter())
 
@@ -61,20 +116,68 @@ handler = logging.StreamHandler()
 handler.setFormatter(JsonFormatter())
 logger = logging.getLogger('JsonLogger')
 logger.setLevel(logging.DEBUG)
-logger.addHandler(file_handler)
-logger.addHandler(handler)
+# Don't propagate to the root logger: basicConfig installed a root
+# StreamHandler that would write each record synchronously on the
+# request thread, duplicating the queued JSON output in plain format
+logger.propagate = False
+
+# Route log records through a queue so formatting and file/stderr writes
+# happen on a background thread instead of blocking the request thread
+log_queue = queue.Queue(-1)
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler, handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# In-memory cache of the parsed course catalog, keyed by file mtime so
+# external edits to the file are still picked up; "index" maps course
+# code -> course dict for O(1) lookups in course_details
+_cache = {"mtime": None, "data": None, "index": None}
+_cache_lock = threading.Lock()
 
 # Utility Functions
+def _migrate_legacy_catalog():
+    """One-time conversion of the legacy JSON-array file to JSON lines."""
+    if not os.path.exists(LEGACY_COURSE_FILE):
+        return
+    with open(LEGACY_COURSE_FILE, 'rb') as file:
+        courses = _loads(file.read())
+    tmp_file = COURSE_FILE + '.tmp'
+    with open(tmp_file, 'wb') as file:
+        for course in courses:
+            file.write(_dumps(course) + b'\n')
+    os.replace(tmp_file, COURSE_FILE)
+
 def load_courses():
-    """Load courses from the JSON file."""
+    """Load courses from the JSONL file, reusing the cached copy when the file is unchanged."""
+    if not os.path.exists(COURSE_FILE):
+        try:
+            _migrate_legacy_catalog()
+        except json.JSONDecodeError as e:
+            error_message = f"Error decoding JSON from {LEGACY_COURSE_FILE}: {str(e)}"
+            log_error(error_message)
+            return []  # Serve an empty catalog rather than failing at import
     if not os.path.exists(COURSE_FILE):
-        return []  # Return an empty list if the file doesn't exist
+        return []  # Return an empty list if no catalog exists yet
     with tracer.start_as_current_span("Load Courses") as span:
         try:
-            with open(COURSE_FILE, 'r') as file:
-                courses = json.load(file)
-                span.set_attribute("course.count", len(courses))
-                return courses
+            mtime = os.stat(COURSE_FILE).st_mtime_ns
+            with _cache_lock:
+                if mtime == _cache["mtime"]:
+                    span.set_attribute("course.count", len(_cache["data"]))
+                    span.set_attribute("cache.hit", True)
+                    return _cache["data"]
+            # Read the whole file in one large syscall, then split and
+            # parse in memory, instead of iterating it line-by-line
+            with open(COURSE_FILE, 'rb', buffering=1 << 16) as file:
+                courses = [_loads(line) for line in file.read().splitlines() if line.strip()]
+            with _cache_lock:
+                _cache["mtime"] = mtime
+                _cache["data"] = courses
+                _cache["index"] = {course["code"]: course for course in courses}
+            span.set_attribute("course.count", len(courses))
+            span.set_attribute("cache.hit", False)
+            return courses
         except json.JSONDecodeError as e:
             error_message = f"Error decoding JSON from {COURSE_FILE}: {str(e)}"
             span.set_attribute("error.message", error_message)
@@ -82,20 +185,56 @@ def load_courses():
             return []  # Return an empty list if JSON is malformed
 
 def save_courses(data):
-    """Save new course data to the JSON file."""
+    """Append a new course to the in-memory list and to the JSONL file."""
     with tracer.start_as_current_span("Save Courses") as span:
         span.set_attribute("course.name", data["name"])
         span.set_attribute("course.code", data["code"])
-        courses = load_courses()
-        courses.append(data)
-        with open(COURSE_FILE, 'w') as file:
-            json.dump(courses, file, indent=4)
-    logger.info(f"Course added: {data['name']} (Code: {data['code']})")
+        with _cache_lock:
+            courses = _cache["data"] if _cache["data"] is not None else []
+            courses.append(data)
+            # Appending one line is O(1) in catalog size, unlike
+            # rewriting the whole JSON array on every submit
+            with open(COURSE_FILE, 'ab') as file:
+                file.write(_dumps(data) + b'\n')
+            _cache["mtime"] = os.stat(COURSE_FILE).st_mtime_ns
+            _cache["data"] = courses
+            if _cache["index"] is None:
+                _cache["index"] = {}
+            _cache["index"][data["code"]] = data
+    logger.info("Course added: %s (Code: %s)", data['name'], data['code'])
+
+def get_course(code):
+    """Look up a single course by code via the cached index."""
+    load_courses()  # Refresh the cache if the file changed on disk
+    with _cache_lock:
+        index = _cache["index"]
+    return index.get(code) if index else None
 
 def save_telemetry():
     """Save telemetry data to the JSON file."""
-    with open(TELEMETRY_FILE, 'w') as file:
-        json.dump(telemetry_data, file, indent=4)
+    # Snapshot under the lock, then serialize outside it so writers
+    # are never blocked on disk I/O
+    with _telemetry_lock:
+        snapshot = {name: dict(counter) for name, counter in telemetry_data.items()}
+    # Serialize writers too, or two concurrent flushes would truncate and
+    # write the same file at independent offsets and corrupt it
+    with _telemetry_write_lock:
+        with open(TELEMETRY_FILE, 'wb') as file:
+            file.write(_dumps(snapshot, indent=True))
+
+def _flush_telemetry_if_due():
+    """Write telemetry to disk only once every TELEMETRY_FLUSH_EVERY updates."""
+    global _telemetry_dirty
+    with _telemetry_lock:
+        _telemetry_dirty += 1
+        due = _telemetry_dirty >= TELEMETRY_FLUSH_EVERY
+        if due:
+            _telemetry_dirty = 0
+    if due:
+        save_telemetry()
+
+# Make sure counters accumulated since the last flush survive shutdown
+atexit.register(save_telemetry)
 
 # Telemetry Tracking
 @app.before_request
@@ -103,58 +242,84 @@ def before_request():
     """Track the start time and increment request count for the route."""
     g.start_time = time.time()
     route = request.endpoint
-    telemetry_data["route_requests"].setdefault(route, 0)
-    telemetry_data["route_requests"][route] += 1
-    logger.info(f"Processing request for route: {route}")
+    with _telemetry_lock:
+        telemetry_data["route_requests"][route] += 1
+    logger.info("Processing request for route: %s", route)
 
 @app.after_request
 def after_request(response):
     """Track the processing time for the route and save telemetry data."""
     route = request.endpoint
     processing_time = time.time() - g.start_time
-    telemetry_data["route_processing_time"].setdefault(route, 0)
-    telemetry_data["route_processing_time"][route] += processing_time
-    logger.info(f"Route '{route}' processed in {processing_time:.4f} seconds")
-    save_telemetry()
+    with _telemetry_lock:
+        telemetry_data["route_processing_time"][route] += processing_time
+    logger.info("Route '%s' processed in %.4f seconds", route, processing_time)
+    _flush_telemetry_if_due()
     return response
 
 def log_error(error_message):
     """Log an error message and save telemetry data."""
-    telemetry_data["errors"].setdefault(error_message, 0)
-    telemetry_data["errors"][error_message] += 1
+    with _telemetry_lock:
+        telemetry_data["errors"][error_message] += 1
     logger.error(error_message)
-    save_telemetry()
+    _flush_telemetry_if_due()
+
+# Load the catalog once at import so request paths start out served from memory
+load_courses()
 
 # Routes
 @app.route('/')
 def index():
     """Render the index page."""
-    with tracer.start_as_current_span("Render Index") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("client.ip", request.remote_addr)
+    trace.get_current_span().set_attribute("client.ip", request.remote_addr)
     logger.info("Rendering index page")
     return render_template('index.html')
 
 @app.route('/catalog')
 def course_catalog():
     """Render the course catalog page."""
-    with tracer.start_as_current_span("Render Course Catalog") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("client.ip", request.remote_addr)
-        courses = load_courses()
-        span.set_attribute("course.count", len(courses))
+    span = trace.get_current_span()
+    span.set_attribute("client.ip", request.remote_addr)
+    # The rendered page only changes when the catalog file does, so key
+    # an ETag off the file mtime and short-circuit repeat viewers.
+    # Flashed messages are rendered into the page too, so never serve a
+    # 304 while any are queued or they would silently stay in the session
+    etag = None
+    if os.path.exists(COURSE_FILE):
+        etag = str(os.stat(COURSE_FILE).st_mtime_ns)
+        if not session.get('_flashes') and request.if_none_match.contains(etag):
+            span.set_attribute("cache.hit", True)
+            return Response(status=304)
+    courses = load_courses()
+    span.set_attribute("course.count", len(courses))
     logger.info("Rendering course catalog page")
-    return render_template('course_catalog.html', courses=courses)
+    # Pop flashes now, while the session can still be saved: the streamed
+    # body renders after the session cookie has been written, so the pop
+    # done by base.html mid-stream would never persist and the banner
+    # would re-render on every visit. Flask caches the popped messages on
+    # the request context, so the template still sees them.
+    get_flashed_messages(with_categories=True)
+    # Stream the page so the client gets the first bytes while the rest
+    # of the catalog is still rendering
+    response = Response(
+        stream_with_context(stream_template('course_catalog.html', courses=courses)),
+        mimetype='text/html',
+    )
+    if etag is not None:
+        response.set_etag(etag)
+        # no-cache (not max-age) so the browser revalidates every time;
+        # otherwise a fresh cached copy would hide a just-added course
+        # and its success flash until the age expired
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/course/<code>')
 def course_details(code):
     """Render the details of a specific course."""
-    with tracer.start_as_current_span("View Course Details") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("client.ip", request.remote_addr)
-        span.set_attribute("course.code", code)
-        courses = load_courses()
-        course = next((course for course in courses if course['code'] == code), None)
+    span = trace.get_current_span()
+    span.set_attribute("client.ip", request.remote_addr)
+    span.set_attribute("course.code", code)
+    course = get_course(code)
     if not course:
         error_message = f"No course found with code '{code}'."
         span.set_attribute("error.message", error_message)
@@ -162,7 +327,7 @@ def course_details(code):
         log_error(error_message)
         flash(error_message, "error")
         return redirect(url_for('course_catalog'))
-    logger.info(f"Rendering details for course: {course['name']} (Code: {course['code']})")
+    logger.info("Rendering details for course: %s (Code: %s)", course['name'], course['code'])
     span.set_attribute("course.exists", True)
     span.set_attribute("course.name", course["name"])
     return render_template('course_details.html', course=course)
@@ -170,10 +335,9 @@ def course_details(code):
 @app.route('/form')
 def forming():
     """Render the form for adding a new course."""
-    with tracer.start_as_current_span("Render Form") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("client.ip", request.remote_addr)
-        span.set_attribute("form.name", "Course Submission Form")
+    span = trace.get_current_span()
+    span.set_attribute("client.ip", request.remote_addr)
+    span.set_attribute("form.name", "Course Submission Form")
     logger.info("Rendering course addition form")
     return render_template("form.html")
 
@@ -184,41 +348,23 @@ def submitting():
     This route accepts both POST and GET requests. It collects course details from the form,
     validates the required fields, and either saves the course or returns an error message.
     """
-    with tracer.start_as_current_span("Submit Course Details") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("client.ip", request.remote_addr)
-
-        code = request.form.get("code")
-        name = request.form.get("name")
-        instructor = request.form.get("instructor")
-        semester = request.form.get("semester")
-        schedule = request.form.get("schedule")
-        classroom = request.form.get("classroom")
-        prerequisites = request.form.get("prerequisites")
-        grading = request.form.get("grading")
-        description = request.form.get("description")
-
-    if not all([code, name, instructor, semester]):
+    span = trace.get_current_span()
+    span.set_attribute("client.ip", request.remote_addr)
+
+    fields = ("code", "name", "instructor", "semester", "schedule",
+              "classroom", "prerequisites", "grading", "description")
+    course = {field: request.form.get(field, "") for field in fields}
+
+    if not all(course[field] for field in ("code", "name", "instructor", "semester")):
         error_message = "Some fields were missing. Course Not Added."
         span.set_attribute("error.message", error_message)
         log_error(error_message)
         flash(error_message, "error")
     else:
-        course = {
-            "code": code,
-            "name": name,
-            "instructor": instructor,
-            "semester": semester,
-            "schedule": schedule,
-            "classroom": classroom,
-            "prerequisites": prerequisites,
-            "grading": grading,
-            "description": description
-        }
         save_courses(course)
-        span.set_attribute("course.name", name)
-        span.set_attribute("course.code", code)
-        flash(f"Course '{name}' has been successfully added!", "success")
+        span.set_attribute("course.name", course["name"])
+        span.set_attribute("course.code", course["code"])
+        flash(f"Course '{course['name']}' has been successfully added!", "success")
     return redirect(url_for('course_catalog'))
 
 if __name__ == '__main__':